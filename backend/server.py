@@ -1,26 +1,205 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pymongo import MongoClient
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 import os
 import uuid
 import qrcode
+from PIL import Image
 import io
 import base64
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import pandas as pd
 from pathlib import Path
 import tempfile
 import json
+from storage import create_store
+import hashlib
+import threading
+import zipfile
+import asyncio
+import time
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Environment variables
 MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.environ.get("DB_NAME", "attendance_system")
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo")  # "mongo", "sqlite" or "memory"
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "attendance.db")
+MONGO_OPTIONS = {
+    "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", "100")),
+    "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", "0")),
+    "waitQueueTimeoutMS": int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+    "serverSelectionTimeoutMS": int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "retryWrites": os.environ.get("MONGO_RETRY_WRITES", "true").lower() == "true",
+    "retryReads": os.environ.get("MONGO_RETRY_READS", "true").lower() == "true"
+}
+READINESS_TIMEOUT_SECONDS = float(os.environ.get("READINESS_TIMEOUT_SECONDS", "1.0"))
 CORS_ORIGINS = os.environ.get("CORS_ORIGINS", "*").split(",")
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "2"))
+EXPORT_CACHE_SIZE = int(os.environ.get("EXPORT_CACHE_SIZE", "32"))
+EXPORT_JOB_TTL_SECONDS = int(os.environ.get("EXPORT_JOB_TTL_SECONDS", "3600"))
+SELFIE_CACHE_CONTROL = os.environ.get("SELFIE_CACHE_CONTROL", "public, max-age=86400, immutable")
+SELFIE_THUMBNAIL_SIZE = int(os.environ.get("SELFIE_THUMBNAIL_SIZE", "160"))
+SELFIE_THUMBNAIL_CACHE_SIZE = int(os.environ.get("SELFIE_THUMBNAIL_CACHE_SIZE", "256"))
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "3600"))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "10"))
+SESSION_GRACE_MINUTES = int(os.environ.get("SESSION_GRACE_MINUTES", "15"))
+SESSION_DEFAULT_MINUTES = int(os.environ.get("SESSION_DEFAULT_MINUTES", "120"))
+SESSION_SWEEP_INTERVAL_SECONDS = int(os.environ.get("SESSION_SWEEP_INTERVAL_SECONDS", "60"))
+CLOSED_SESSION_CACHE_SIZE = int(os.environ.get("CLOSED_SESSION_CACHE_SIZE", "10000"))
 
-app = FastAPI(title="Attendance System API")
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # These are defined below, next to the storage backend. The backfill runs
+    # before serving so the first sweep already sees every session's expiry
+    await backfill_session_expiry()
+    session_sweeper = asyncio.create_task(sweep_expired_sessions())
+    yield
+    session_sweeper.cancel()
+
+app = FastAPI(title="Attendance System API", lifespan=lifespan)
+
+# Idempotent submissions
+IDEMPOTENT_PATHS = {"/api/student/submit-attendance"}
+idempotency_store = OrderedDict()  # key -> entry, oldest first
+
+def evict_idempotency_keys():
+    """Drop expired keys, then the oldest completed ones beyond the size bound"""
+    # Entries share one TTL, so insertion order is expiry order
+    now = time.monotonic()
+    while idempotency_store:
+        key, entry = next(iter(idempotency_store.items()))
+        if entry["expires_at"] > now:
+            break
+        idempotency_store.popitem(last=False)
+        # Wake anyone waiting on an expired in-flight key so they can retry
+        entry["done"].set()
+    
+    # In-flight keys are never evicted early: a waiting retry would re-process the upload
+    overflow = len(idempotency_store) - IDEMPOTENCY_MAX_KEYS
+    if overflow > 0:
+        evicted = []
+        for key, entry in idempotency_store.items():
+            if entry["status"] == "completed":
+                evicted.append(key)
+                if len(evicted) == overflow:
+                    break
+        for key in evicted:
+            del idempotency_store[key]
+
+def get_request_fingerprint(headers: dict) -> str:
+    """Cheap identity for a request, checked without reading the body.
+
+    Only uses what stays the same when a phone retries from a new network
+    (the client address does not). Clients may also send
+    Idempotency-Fingerprint, e.g. a digest of the selfie.
+    """
+    return f"{headers.get(b'content-length', b'').decode()}:{headers.get(b'idempotency-fingerprint', b'').decode()}"
+
+async def send_json(send, status_code: int, content: dict, extra_headers: Optional[dict] = None):
+    response = JSONResponse(status_code=status_code, content=content, headers=extra_headers)
+    await send({"type": "http.response.start", "status": response.status_code, "headers": response.raw_headers})
+    await send({"type": "http.response.body", "body": response.body})
+
+class IdempotencyMiddleware:
+    """Replay completed submissions by Idempotency-Key without reading the upload again.
+
+    A plain ASGI middleware so every other route (selfies, export
+    downloads) passes straight through without extra wrapping.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in IDEMPOTENT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        
+        headers = dict(scope["headers"])
+        key = headers.get(b"idempotency-key", b"").decode()
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        
+        key = f"{scope['path']}:{key}"
+        fingerprint = get_request_fingerprint(headers)
+        evict_idempotency_keys()
+        
+        entry = idempotency_store.get(key)
+        if entry and entry["fingerprint"] != fingerprint:
+            await send_json(send, 422, {"detail": "Idempotency-Key was already used for a different request"})
+            return
+        
+        if entry and entry["status"] == "in_flight":
+            # A retry raced the original request; wait for it rather than processing twice
+            try:
+                await asyncio.wait_for(entry["done"].wait(), timeout=IDEMPOTENCY_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                await send_json(
+                    send, 409,
+                    {"detail": "A request with this Idempotency-Key is still being processed"},
+                    {"Retry-After": "1"}
+                )
+                return
+            entry = idempotency_store.get(key)
+        
+        if entry and entry["status"] == "completed":
+            await send({
+                "type": "http.response.start",
+                "status": entry["status_code"],
+                "headers": entry["headers"] + [(b"idempotent-replayed", b"true")]
+            })
+            await send({"type": "http.response.body", "body": entry["body"]})
+            return
+        
+        entry = {
+            "status": "in_flight",
+            "fingerprint": fingerprint,
+            "done": asyncio.Event(),
+            "expires_at": time.monotonic() + IDEMPOTENCY_TTL_SECONDS
+        }
+        idempotency_store[key] = entry
+        response = {"body": []}
+        
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status_code"] = message["status"]
+                response["headers"] = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, capture_send)
+        except Exception:
+            idempotency_store.pop(key, None)
+            entry["done"].set()
+            raise
+        
+        if response.get("status_code", 500) >= 500:
+            # Server errors are not final; let the client retry for real
+            idempotency_store.pop(key, None)
+        else:
+            entry.update(
+                status="completed",
+                status_code=response["status_code"],
+                headers=response["headers"],
+                body=b"".join(response["body"])
+            )
+        entry["done"].set()
+
+# Registered before CORS so CORS headers are added to replays too
+app.add_middleware(IdempotencyMiddleware)
 
 # CORS configuration
 app.add_middleware(
@@ -31,11 +210,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# MongoDB connection
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
-attendance_sessions = db.attendance_sessions
-attendance_records = db.attendance_records
+# Storage backend (see storage.py)
+store = create_store(STORAGE_BACKEND, mongo_url=MONGO_URL, db_name=DB_NAME, sqlite_path=SQLITE_PATH, mongo_options=MONGO_OPTIONS)
+
+# Session expiry
+closed_session_ids = OrderedDict()  # session_id -> None; sessions never reopen, so this never goes stale
+
+def get_open_session(session_id: str) -> Optional[dict]:
+    """Return an active, unexpired session, rejecting known-expired IDs without a DB round trip"""
+    if session_id in closed_session_ids:
+        return None
+    
+    session = store.get_active_session(session_id)
+    if not session:
+        # Missing and deactivated IDs are both cheap partial-index misses, so only
+        # sessions we have actually seen past their expiry are remembered
+        return None
+    
+    if not session.get("expires_at"):
+        # Not backfilled yet; judge it by the expiry the backfill would give it
+        session["expires_at"] = compute_legacy_session_expiry(session)
+    if session["expires_at"] <= datetime.now():
+        closed_session_ids[session_id] = None
+        while len(closed_session_ids) > CLOSED_SESSION_CACHE_SIZE:
+            closed_session_ids.popitem(last=False)
+        return None
+    return session
+
+def compute_legacy_session_expiry(session: dict) -> datetime:
+    return compute_session_expiry(session.get("date", ""), session.get("time_slot", ""), session.get("created_at") or datetime.now())
+
+async def backfill_session_expiry():
+    """Give sessions created before expiry existed an expires_at so the sweep can close them"""
+    try:
+        backfilled_count = await asyncio.to_thread(store.backfill_session_expiry, compute_legacy_session_expiry)
+        if backfilled_count:
+            logger.info("Set expires_at on %d existing attendance sessions", backfilled_count)
+    except Exception:
+        logger.exception("Failed to backfill session expiry")
+
+async def sweep_expired_sessions():
+    """Periodically deactivate sessions past their expires_at"""
+    try:
+        await asyncio.to_thread(store.ensure_indexes)
+    except Exception:
+        logger.exception("Failed to create storage indexes")
+    
+    while True:
+        try:
+            expired_count = await asyncio.to_thread(store.expire_sessions, datetime.now())
+            if expired_count:
+                logger.info("Closed %d expired attendance sessions", expired_count)
+        except Exception:
+            logger.exception("Session sweep failed")
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_SECONDS)
+
 
 # Pydantic models
 class AttendanceSession(BaseModel):
@@ -69,6 +298,16 @@ class StudentAuth(BaseModel):
     name: str
     enrollment_number: str
 
+class ExportJobQuery(BaseModel):
+    semester: str
+    class_name: Optional[str] = None
+    subject: Optional[str] = None
+    faculty: Optional[str] = None
+    time_slot: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    format: str = "xlsx"  # "xlsx" (one sheet per session) or "zip" (one file per session)
+
 # Utility functions
 def generate_qr_code(data: str) -> str:
     """Generate QR code and return base64 encoded image"""
@@ -84,16 +323,76 @@ def generate_qr_code(data: str) -> str:
     img_base64 = base64.b64encode(buffer.getvalue()).decode()
     return f"data:image/png;base64,{img_base64}"
 
+def compute_session_expiry(session_date: str, time_slot: str, created_at: datetime) -> datetime:
+    """Sessions close at the end of their time slot plus a grace period.
+
+    Time slots look like "9:00-10:00". If the slot can't be parsed the
+    session gets SESSION_DEFAULT_MINUTES from creation. A session created
+    after its slot ended still gets the grace period.
+    """
+    grace = timedelta(minutes=SESSION_GRACE_MINUTES)
+    try:
+        slot_end = time_slot.split("-")[1].strip()
+        expires_at = datetime.strptime(f"{session_date} {slot_end}", "%Y-%m-%d %H:%M") + grace
+    except (IndexError, ValueError):
+        expires_at = created_at + timedelta(minutes=SESSION_DEFAULT_MINUTES)
+    return max(expires_at, created_at + grace)
+
 def validate_charusat_email(email: str) -> bool:
     """Validate if email belongs to charusat.edu.in domain"""
     return email.endswith("@charusat.edu.in")
 
+def build_excel_rows(records: List[dict]) -> List[dict]:
+    """Convert attendance records into rows for an Excel sheet"""
+    excel_data = []
+    for record in records:
+        excel_data.append({
+            "Student Name": record.get("student_name", ""),
+            "Enrollment Number": record.get("enrollment_number", ""),
+            "Email": record.get("email", ""),
+            "Time Slot": record.get("time_slot", ""),
+            "Subject": record.get("subject", ""),
+            "Faculty": record.get("faculty", ""),
+            "Class": record.get("class_name", ""),
+            "Semester": record.get("semester", ""),
+            "Date": record.get("date", ""),
+            "Attendance Time": record.get("timestamp").isoformat().replace("T", " ").split(".")[0] if record.get("timestamp") else ""
+        })
+    return excel_data
+
 # API Routes
 
 @app.get("/api/health")
+@app.get("/api/health/live")
 async def health_check():
+    """Liveness: the process is up and serving requests (no DB access)"""
     return {"status": "healthy", "timestamp": datetime.now()}
 
+@app.get("/api/health/ready")
+async def readiness_check():
+    """Readiness: the storage backend answers a round trip within the time budget"""
+    started = time.monotonic()
+    try:
+        # The store enforces the budget itself, so the worker thread ends with the probe
+        await asyncio.to_thread(store.ping, READINESS_TIMEOUT_SECONDS)
+        status, error = "ready", None
+    except TimeoutError:
+        status, error = "degraded", f"Database ping exceeded {READINESS_TIMEOUT_SECONDS}s"
+    except Exception as e:
+        status, error = "unavailable", str(e)
+    
+    body = {
+        "status": status,
+        "storage_backend": store.name,
+        "db_latency_ms": round((time.monotonic() - started) * 1000, 2),
+        "pool": store.pool_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+    if error:
+        body["error"] = error
+    
+    return JSONResponse(status_code=200 if status == "ready" else 503, content=body)
+
 @app.post("/api/teacher/create-session")
 async def create_attendance_session(session: AttendanceSession):
     """Create new attendance session and generate QR code"""
@@ -102,6 +401,7 @@ async def create_attendance_session(session: AttendanceSession):
         session_id = str(uuid.uuid4())
         
         # Create session document
+        created_at = datetime.now()
         session_doc = {
             "session_id": session_id,
             "time_slot": session.time_slot,
@@ -111,12 +411,13 @@ async def create_attendance_session(session: AttendanceSession):
             "class_name": session.class_name,
             "semester": session.semester,
             "date": session.date,
-            "created_at": datetime.now(),
+            "created_at": created_at,
+            "expires_at": compute_session_expiry(session.date, session.time_slot, created_at),
             "is_active": True
         }
         
         # Insert into database
-        attendance_sessions.insert_one(session_doc)
+        store.create_session(session_doc)
         
         # Generate QR code data (URL for student to scan)
         qr_data = f"session_id={session_id}"
@@ -130,6 +431,7 @@ async def create_attendance_session(session: AttendanceSession):
             "session_id": session_id,
             "qr_code": qr_code_image,
             "link": link,
+            "expires_at": session_doc["expires_at"],
             "message": "Attendance session created successfully"
         }
         
@@ -141,10 +443,7 @@ async def authenticate_student(auth: StudentAuth):
     """Mock authentication for demo - validate email and session"""
     try:
         # Check if session exists and is active
-        session = attendance_sessions.find_one({
-            "session_id": auth.session_id,
-            "is_active": True
-        })
+        session = get_open_session(auth.session_id)
         
         if not session:
             raise HTTPException(status_code=404, detail="Invalid or expired session")
@@ -154,12 +453,9 @@ async def authenticate_student(auth: StudentAuth):
             raise HTTPException(status_code=403, detail="Only @charusat.edu.in emails are allowed")
         
         # Check if student already marked attendance
-        existing_record = attendance_records.find_one({
-            "session_id": auth.session_id,
-            "email": auth.email
-        })
+        already_marked = store.record_exists(auth.session_id, auth.email)
         
-        if existing_record:
+        if already_marked:
             raise HTTPException(status_code=409, detail="Attendance already marked for this session")
         
         return {
@@ -190,10 +486,7 @@ async def submit_attendance(
     """Submit attendance with selfie"""
     try:
         # Validate session
-        session = attendance_sessions.find_one({
-            "session_id": session_id,
-            "is_active": True
-        })
+        session = get_open_session(session_id)
         
         if not session:
             raise HTTPException(status_code=404, detail="Invalid or expired session")
@@ -203,17 +496,15 @@ async def submit_attendance(
             raise HTTPException(status_code=403, detail="Only @charusat.edu.in emails are allowed")
         
         # Check for duplicate attendance
-        existing_record = attendance_records.find_one({
-            "session_id": session_id,
-            "email": email
-        })
+        already_marked = store.record_exists(session_id, email)
         
-        if existing_record:
+        if already_marked:
             raise HTTPException(status_code=409, detail="Attendance already marked")
         
         # Process selfie
         selfie_content = await selfie.read()
         selfie_base64 = base64.b64encode(selfie_content).decode()
+        selfie_sha256 = hashlib.sha256(selfie_content).hexdigest()
         
         # Create attendance record
         attendance_record = {
@@ -223,6 +514,8 @@ async def submit_attendance(
             "enrollment_number": enrollment_number,
             "email": email,
             "selfie_data": selfie_base64,
+            "selfie_sha256": selfie_sha256,  # Lets the selfie endpoint answer 304s without loading the image
+            "selfie_content_type": detect_selfie_content_type(selfie_content),
             "timestamp": datetime.now(),
             # Copy session details for easy querying
             "time_slot": session["time_slot"],
@@ -235,7 +528,7 @@ async def submit_attendance(
         }
         
         # Insert attendance record
-        attendance_records.insert_one(attendance_record)
+        store.insert_record(attendance_record)
         
         return {
             "success": True,
@@ -263,15 +556,15 @@ async def get_attendance(query: AttendanceQuery):
         }
         
         # Get attendance records
-        records = list(attendance_records.find(filter_query, {
-            "selfie_data": 0  # Exclude selfie data from initial response
-        }))
+        records = store.find_records(filter_query)  # Selfie data is excluded from the listing
         
-        # Convert ObjectId to string for JSON serialization
+        # Convert datetimes for JSON serialization
         for record in records:
-            record["_id"] = str(record["_id"])
             if "timestamp" in record:
                 record["timestamp"] = record["timestamp"].isoformat()
+            if "record_id" in record:
+                record["selfie_url"] = f"/api/records/{record['record_id']}/selfie"
+                record["thumbnail_url"] = f"/api/records/{record['record_id']}/selfie/thumbnail"
         
         return {
             "success": True,
@@ -298,28 +591,13 @@ async def download_attendance(query: AttendanceQuery):
         }
         
         # Get attendance records
-        records = list(attendance_records.find(filter_query, {
-            "selfie_data": 0  # Exclude selfie data
-        }))
+        records = store.find_records(filter_query)
         
         if not records:
             raise HTTPException(status_code=404, detail="No attendance records found")
         
         # Prepare data for Excel
-        excel_data = []
-        for record in records:
-            excel_data.append({
-                "Student Name": record.get("student_name", ""),
-                "Enrollment Number": record.get("enrollment_number", ""),
-                "Email": record.get("email", ""),
-                "Time Slot": record.get("time_slot", ""),
-                "Subject": record.get("subject", ""),
-                "Faculty": record.get("faculty", ""),
-                "Class": record.get("class_name", ""),
-                "Semester": record.get("semester", ""),
-                "Date": record.get("date", ""),
-                "Attendance Time": record.get("timestamp").isoformat().replace("T", " ").split(".")[0] if record.get("timestamp") else ""
-            })
+        excel_data = build_excel_rows(records)
         
         # Create DataFrame and Excel file
         df = pd.DataFrame(excel_data)
@@ -343,6 +621,276 @@ async def download_attendance(query: AttendanceQuery):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate Excel file: {str(e)}")
 
+# Background export jobs
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+export_jobs = {}
+export_cache = OrderedDict()  # cache_key -> result file path, least recently used first
+export_jobs_lock = threading.Lock()
+
+EXPORT_MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "zip": "application/zip"
+}
+
+def build_export_filter(query: ExportJobQuery) -> dict:
+    """Build the records filter for a date-range or whole-semester export"""
+    filter_query = {"semester": query.semester}
+    for field in ("class_name", "subject", "faculty", "time_slot"):
+        value = getattr(query, field)
+        if value:
+            filter_query[field] = value
+    
+    # Dates are stored as ISO strings, so lexical comparison of the
+    # normalised isoformat() values matches date order
+    date_range = {}
+    if query.start_date:
+        date_range["$gte"] = query.start_date.isoformat()
+    if query.end_date:
+        date_range["$lte"] = query.end_date.isoformat()
+    if date_range:
+        filter_query["date"] = date_range
+    
+    return filter_query
+
+def get_export_data_version(filter_query: dict) -> tuple:
+    """Return (record count, data version) for the records an export would include"""
+    count, last_timestamp = store.summarize_records(filter_query)
+    if count == 0:
+        return 0, "empty"
+    
+    version = f"{count}:{last_timestamp.isoformat() if last_timestamp else ''}"
+    return count, version
+
+def get_export_cache_key(query: ExportJobQuery, data_version: str) -> str:
+    """Key export results by the query and the version of the data it covers"""
+    payload = json.dumps({"query": query.model_dump(mode="json"), "version": data_version}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def make_sheet_name(session_key: tuple, used_names: set) -> str:
+    """Build a unique Excel-safe sheet name (max 31 chars) for a session"""
+    date_str, time_slot, subject, _, class_name, _ = session_key
+    name = f"{date_str} {time_slot} {class_name} {subject}"
+    for char in '[]:*?/\\':
+        name = name.replace(char, "-")
+    name = name[:31]
+    
+    base_name, suffix = name, 1
+    while name in used_names:
+        suffix += 1
+        tail = f" ({suffix})"
+        name = base_name[:31 - len(tail)] + tail
+    used_names.add(name)
+    return name
+
+def time_slot_start_minutes(time_slot: str) -> int:
+    """Minutes since midnight for the start of a slot like "9:00-10:00" (unparseable slots sort last)"""
+    try:
+        hours, minutes = time_slot.split("-")[0].strip().split(":")
+        return int(hours) * 60 + int(minutes)
+    except (ValueError, AttributeError):
+        return 24 * 60
+
+def group_records_by_session(records: List[dict]) -> "OrderedDict[tuple, List[dict]]":
+    """Group records (already sorted by date and time slot) into per-session lists"""
+    sessions = OrderedDict()
+    for record in records:
+        session_key = (
+            record.get("date", ""),
+            record.get("time_slot", ""),
+            record.get("subject", ""),
+            record.get("faculty", ""),
+            record.get("class_name", ""),
+            record.get("semester", "")
+        )
+        sessions.setdefault(session_key, []).append(record)
+    return sessions
+
+def update_export_job(job_id: str, **fields):
+    with export_jobs_lock:
+        export_jobs[job_id].update(fields)
+
+def store_export_result(cache_key: str, result_path: str):
+    """Add a finished export to the result cache, evicting the oldest entries"""
+    with export_jobs_lock:
+        export_cache[cache_key] = result_path
+        export_cache.move_to_end(cache_key)
+        while len(export_cache) > EXPORT_CACHE_SIZE:
+            _, evicted_path = export_cache.popitem(last=False)
+            try:
+                os.remove(evicted_path)
+            except OSError:
+                pass
+
+def run_export_job(job_id: str, filter_query: dict, export_format: str, cache_key: str):
+    """Build the export workbook/archive in a background worker thread"""
+    temp_file = None
+    try:
+        update_export_job(job_id, status="running", started_at=datetime.now())
+        
+        # Slots are strings ("10:00-11:00" < "9:00-10:00"), so order them by parsed start time
+        records = store.find_records(filter_query, sort=[("date", 1), ("timestamp", 1)])
+        records.sort(key=lambda record: (
+            record.get("date", ""),
+            time_slot_start_minutes(record.get("time_slot", "")),
+            record.get("time_slot", "")
+        ))
+        sessions = group_records_by_session(records)
+        update_export_job(job_id, total_records=len(records), total_sessions=len(sessions))
+        
+        # Records can be reset between submitting the job and it running
+        if not sessions:
+            update_export_job(job_id, status="failed", error="No attendance records found", completed_at=datetime.now())
+            return
+        
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f".{export_format}")
+        temp_file.close()
+        
+        used_names = set()
+        if export_format == "zip":
+            with zipfile.ZipFile(temp_file.name, "w", zipfile.ZIP_DEFLATED) as archive:
+                for index, (session_key, session_records) in enumerate(sessions.items(), start=1):
+                    buffer = io.BytesIO()
+                    pd.DataFrame(build_excel_rows(session_records)).to_excel(buffer, index=False)
+                    archive.writestr(f"{make_sheet_name(session_key, used_names)}.xlsx", buffer.getvalue())
+                    update_export_job(job_id, processed_sessions=index, progress=int(index * 100 / len(sessions)))
+        else:
+            with pd.ExcelWriter(temp_file.name, engine="openpyxl") as writer:
+                for index, (session_key, session_records) in enumerate(sessions.items(), start=1):
+                    df = pd.DataFrame(build_excel_rows(session_records))
+                    df.to_excel(writer, sheet_name=make_sheet_name(session_key, used_names), index=False)
+                    update_export_job(job_id, processed_sessions=index, progress=int(index * 100 / len(sessions)))
+        
+        store_export_result(cache_key, temp_file.name)
+        update_export_job(job_id, status="completed", progress=100, result_path=temp_file.name, completed_at=datetime.now())
+        
+    except Exception as e:
+        if temp_file:
+            try:
+                os.remove(temp_file.name)
+            except OSError:
+                pass
+        update_export_job(job_id, status="failed", error=str(e), completed_at=datetime.now())
+
+def prune_export_jobs():
+    """Forget finished jobs older than the job TTL (caller holds export_jobs_lock)"""
+    now = datetime.now()
+    expired = [
+        job_id for job_id, job in export_jobs.items()
+        if job["completed_at"] and (now - job["completed_at"]).total_seconds() > EXPORT_JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        del export_jobs[job_id]
+
+def serialize_export_job(job: dict) -> dict:
+    """Public view of an export job (internal fields stripped)"""
+    response = {
+        key: value for key, value in job.items()
+        if key not in ("result_path", "cache_key")
+    }
+    if job["status"] == "completed":
+        response["download_url"] = f"/api/teacher/export-jobs/{job['job_id']}/download"
+    return response
+
+@app.post("/api/teacher/export-jobs")
+async def create_export_job(query: ExportJobQuery):
+    """Queue a date-range or whole-semester export and return immediately"""
+    try:
+        if query.format not in EXPORT_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail="Export format must be 'xlsx' or 'zip'")
+        
+        if query.start_date and query.end_date and query.start_date > query.end_date:
+            raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+        
+        filter_query = build_export_filter(query)
+        record_count, data_version = get_export_data_version(filter_query)
+        
+        if record_count == 0:
+            raise HTTPException(status_code=404, detail="No attendance records found")
+        
+        cache_key = get_export_cache_key(query, data_version)
+        
+        with export_jobs_lock:
+            # Reuse an export that is already running for the same query and data
+            for job in export_jobs.values():
+                if job["cache_key"] == cache_key and job["status"] in ("queued", "running"):
+                    return {"success": True, **serialize_export_job(job)}
+            
+            job = {
+                "job_id": str(uuid.uuid4()),
+                "status": "queued",
+                "progress": 0,
+                "format": query.format,
+                "query_info": filter_query,
+                "total_records": record_count,
+                "total_sessions": None,
+                "processed_sessions": 0,
+                "cached": False,
+                "error": None,
+                "created_at": datetime.now(),
+                "completed_at": None,
+                "cache_key": cache_key,
+                "result_path": None
+            }
+            
+            # Serve straight from the result cache when the data has not changed
+            cached_path = export_cache.get(cache_key)
+            if cached_path and os.path.exists(cached_path):
+                export_cache.move_to_end(cache_key)
+                job.update(status="completed", progress=100, cached=True, result_path=cached_path, completed_at=datetime.now())
+            
+            export_jobs[job["job_id"]] = job
+            prune_export_jobs()
+            response = {"success": True, **serialize_export_job(job)}
+        
+        if job["status"] == "queued":
+            export_executor.submit(run_export_job, job["job_id"], filter_query, query.format, cache_key)
+        
+        return response
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create export job: {str(e)}")
+
+@app.get("/api/teacher/export-jobs/{job_id}")
+async def get_export_job(job_id: str):
+    """Poll the status and progress of an export job"""
+    with export_jobs_lock:
+        job = export_jobs.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        return {"success": True, **serialize_export_job(job)}
+
+@app.get("/api/teacher/export-jobs/{job_id}/download")
+async def download_export_job(job_id: str):
+    """Download the workbook or ZIP produced by a completed export job"""
+    with export_jobs_lock:
+        job = export_jobs.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        job = dict(job)
+    
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Export job is {job['status']}")
+    
+    if not job["result_path"] or not os.path.exists(job["result_path"]):
+        raise HTTPException(status_code=410, detail="Export result has expired, please submit the export again")
+    
+    query_info = job["query_info"]
+    date_range = query_info.get("date", {})
+    filename = "attendance_sem{}_{}_{}.{}".format(
+        query_info["semester"],
+        date_range.get("$gte", "start"),
+        date_range.get("$lte", "end"),
+        job["format"]
+    )
+    
+    return FileResponse(
+        job["result_path"],
+        media_type=EXPORT_MEDIA_TYPES[job["format"]],
+        filename=filename
+    )
+
 @app.post("/api/teacher/reset-attendance")
 async def reset_attendance(query: AttendanceQuery):
     """Reset/delete attendance records for given parameters"""
@@ -358,24 +906,21 @@ async def reset_attendance(query: AttendanceQuery):
         }
         
         # Count records to be deleted
-        count = attendance_records.count_documents(filter_query)
+        count = store.count_records(filter_query)
         
         if count == 0:
             raise HTTPException(status_code=404, detail="No attendance records found to reset")
         
         # Delete attendance records
-        result = attendance_records.delete_many(filter_query)
+        deleted_count = store.delete_records(filter_query)
         
         # Also deactivate the session if exists
-        attendance_sessions.update_many(
-            filter_query,
-            {"$set": {"is_active": False}}
-        )
+        store.deactivate_sessions(filter_query)
         
         return {
             "success": True,
-            "message": f"Successfully reset {result.deleted_count} attendance records",
-            "deleted_count": result.deleted_count
+            "message": f"Successfully reset {deleted_count} attendance records",
+            "deleted_count": deleted_count
         }
         
     except HTTPException:
@@ -383,14 +928,195 @@ async def reset_attendance(query: AttendanceQuery):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to reset attendance: {str(e)}")
 
+# Selfie retrieval
+selfie_thumbnail_cache = OrderedDict()  # etag -> thumbnail bytes, least recently used first
+selfie_thumbnail_lock = threading.Lock()
+
+# Only these are ever served under their own type; anything else is an opaque download
+SELFIE_MEDIA_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+SELFIE_FILENAMES = {"image/jpeg": "selfie.jpg", "image/png": "selfie.png", "image/webp": "selfie.webp"}
+
+def detect_selfie_content_type(content: bytes) -> str:
+    """Work out the image type from the bytes; the uploader's Content-Type is not trusted"""
+    try:
+        return SELFIE_MEDIA_TYPES.get(Image.open(io.BytesIO(content)).format, "application/octet-stream")
+    except Exception:
+        return "application/octet-stream"
+
+def safe_selfie_content_type(content_type: Optional[str]) -> str:
+    # Records stored before type detection carry the uploader-supplied type
+    return content_type if content_type in SELFIE_FILENAMES else "application/octet-stream"
+
+def binary_cache_headers(etag: str, filename: str) -> dict:
+    return {
+        "ETag": etag,
+        "Cache-Control": SELFIE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff",
+        "Content-Disposition": f'inline; filename="{filename}"'
+    }
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against a strong ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+RANGE_NOT_SATISFIABLE = ()
+
+def parse_byte_range(range_header: str, size: int) -> Optional[tuple]:
+    """Parse a single 'bytes=' range.
+
+    Returns (start, end) inclusive, RANGE_NOT_SATISFIABLE for a valid
+    range outside the content, or None when the header should be ignored
+    (other units, multiple ranges, bad syntax) and the full body served.
+    """
+    units, _, range_spec = range_header.partition("=")
+    if units.strip() != "bytes" or "," in range_spec:
+        return None
+    
+    start_str, _, end_str = range_spec.strip().partition("-")
+    if not (start_str.isdigit() or start_str == "") or not (end_str.isdigit() or end_str == ""):
+        return None
+    
+    if start_str:
+        start = int(start_str)
+        if end_str and int(end_str) < start:
+            return None
+        if start >= size:
+            return RANGE_NOT_SATISFIABLE
+        end = int(end_str) if end_str else size - 1
+    elif end_str:
+        # Suffix range: the last N bytes
+        suffix_length = int(end_str)
+        if suffix_length == 0 or size == 0:
+            return RANGE_NOT_SATISFIABLE
+        start = max(size - suffix_length, 0)
+        end = size - 1
+    else:
+        return None
+    
+    return start, min(end, size - 1)
+
+def build_cached_binary_response(request: Request, content: bytes, etag: str, media_type: str, filename: str) -> Response:
+    """Serve immutable binary content with ETag, Cache-Control, 304 and Range support"""
+    headers = binary_cache_headers(etag, filename)
+    
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_byte_range(range_header, len(content))
+        if byte_range == RANGE_NOT_SATISFIABLE:
+            headers["Content-Range"] = f"bytes */{len(content)}"
+            return Response(status_code=416, headers=headers)
+        
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+            return Response(content=content[start:end + 1], status_code=206, headers=headers, media_type=media_type)
+    
+    return Response(content=content, headers=headers, media_type=media_type)
+
+def get_selfie_record(record_id: str, include_data: bool) -> dict:
+    """Fetch a record's selfie metadata, and the image itself only when needed"""
+    record = store.get_record_selfie(record_id, include_data)
+    if not record:
+        raise HTTPException(status_code=404, detail="Attendance record not found")
+    
+    # Records submitted before selfie hashes were stored need the image to derive one
+    if not record.get("selfie_sha256") and not include_data:
+        return get_selfie_record(record_id, include_data=True)
+    
+    if include_data:
+        if not record.get("selfie_data"):
+            raise HTTPException(status_code=404, detail="No selfie stored for this record")
+        record["selfie_bytes"] = base64.b64decode(record["selfie_data"])
+        if not record.get("selfie_sha256"):
+            record["selfie_sha256"] = hashlib.sha256(record["selfie_bytes"]).hexdigest()
+    
+    return record
+
+def make_selfie_thumbnail(content: bytes) -> bytes:
+    """Downscale a selfie to a JPEG thumbnail (CPU-bound; run it off the event loop)"""
+    image = Image.open(io.BytesIO(content))
+    # Lets JPEGs decode at a reduced scale instead of full resolution
+    image.draft("RGB", (SELFIE_THUMBNAIL_SIZE, SELFIE_THUMBNAIL_SIZE))
+    image.thumbnail((SELFIE_THUMBNAIL_SIZE, SELFIE_THUMBNAIL_SIZE))
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=80, optimize=True)
+    return buffer.getvalue()
+
+@app.get("/api/records/{record_id}/selfie")
+async def get_record_selfie(record_id: str, request: Request):
+    """Serve the stored selfie for an attendance record"""
+    try:
+        # Revalidations only need the stored hash; cold requests fetch the image in the same query
+        record = get_selfie_record(record_id, include_data="if-none-match" not in request.headers)
+        etag = f'"{record["selfie_sha256"]}"'
+        
+        media_type = safe_selfie_content_type(record.get("selfie_content_type"))
+        filename = SELFIE_FILENAMES.get(media_type, "selfie.bin")
+        
+        # Answer revalidations from the stored hash without loading the image
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=binary_cache_headers(etag, filename))
+        
+        if "selfie_bytes" not in record:
+            record = get_selfie_record(record_id, include_data=True)
+        
+        return build_cached_binary_response(request, record["selfie_bytes"], etag, media_type, filename)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get selfie: {str(e)}")
+
+@app.get("/api/records/{record_id}/selfie/thumbnail")
+async def get_record_selfie_thumbnail(record_id: str, request: Request):
+    """Serve a small JPEG thumbnail of the selfie for review grids"""
+    try:
+        record = get_selfie_record(record_id, include_data="if-none-match" not in request.headers)
+        etag = f'"{record["selfie_sha256"]}-thumb{SELFIE_THUMBNAIL_SIZE}"'
+        
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=binary_cache_headers(etag, "thumbnail.jpg"))
+        
+        with selfie_thumbnail_lock:
+            thumbnail = selfie_thumbnail_cache.get(etag)
+            if thumbnail is not None:
+                selfie_thumbnail_cache.move_to_end(etag)
+        
+        if thumbnail is None:
+            if "selfie_bytes" not in record:
+                record = get_selfie_record(record_id, include_data=True)
+            try:
+                thumbnail = await asyncio.to_thread(make_selfie_thumbnail, record["selfie_bytes"])
+            except (OSError, Image.DecompressionBombError):
+                raise HTTPException(status_code=415, detail="Selfie could not be decoded as an image")
+            
+            with selfie_thumbnail_lock:
+                selfie_thumbnail_cache[etag] = thumbnail
+                while len(selfie_thumbnail_cache) > SELFIE_THUMBNAIL_CACHE_SIZE:
+                    selfie_thumbnail_cache.popitem(last=False)
+        
+        return build_cached_binary_response(request, thumbnail, etag, "image/jpeg", "thumbnail.jpg")
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get selfie thumbnail: {str(e)}")
+
 @app.get("/api/session/{session_id}")
 async def get_session_info(session_id: str):
     """Get session information for student authentication"""
     try:
-        session = attendance_sessions.find_one({
-            "session_id": session_id,
-            "is_active": True
-        })
+        session = get_open_session(session_id)
         
         if not session:
             raise HTTPException(status_code=404, detail="Session not found or expired")
@@ -405,7 +1131,8 @@ async def get_session_info(session_id: str):
                 "time_slot": session["time_slot"],
                 "date": session["date"],
                 "lecture_or_lab": session["lecture_or_lab"],
-                "semester": session["semester"]
+                "semester": session["semester"],
+                "expires_at": session["expires_at"]
             }
         }
         
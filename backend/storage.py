@@ -0,0 +1,604 @@
+"""Storage backends for attendance sessions and records.
+
+Filters passed to the stores use the same shape as the Mongo queries in
+server.py: field equality, plus an optional {"$gte": ..., "$lte": ...}
+range on string/date fields.
+"""
+from abc import ABC, abstractmethod
+from pymongo import MongoClient, UpdateOne, monitoring, timeout as operation_timeout
+from pymongo.errors import PyMongoError
+from typing import Callable, List, Optional, Tuple
+from datetime import datetime
+import json
+import sqlite3
+import threading
+
+# Fields the routes filter records and sessions on
+FILTER_FIELDS = ("class_name", "time_slot", "faculty", "subject", "semester", "date")
+DATETIME_FIELDS = ("timestamp", "created_at", "expires_at")
+
+
+class AttendanceStore(ABC):
+    """Operations the API needs on sessions and records.
+
+    A backend missing any abstract method fails when it is constructed.
+    """
+
+    name = "base"
+
+    # Sessions
+    @abstractmethod
+    def create_session(self, session_doc: dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_active_session(self, session_id: str) -> Optional[dict]:
+        """Return the session if it is active; callers check expires_at, which legacy rows may lack"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def deactivate_sessions(self, filter_query: dict) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def expire_sessions(self, now: datetime) -> int:
+        """Deactivate active sessions whose expires_at has passed"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def backfill_session_expiry(self, compute_expiry: Callable[[dict], datetime]) -> int:
+        """Set expires_at on active sessions created before sessions expired"""
+        raise NotImplementedError
+
+    # Records
+    @abstractmethod
+    def insert_record(self, record_doc: dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def record_exists(self, session_id: str, email: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_records(self, filter_query: dict, include_selfie: bool = False, sort: Optional[List[Tuple[str, int]]] = None) -> List[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_records(self, filter_query: dict) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def summarize_records(self, filter_query: dict) -> Tuple[int, Optional[datetime]]:
+        """Return (record count, latest timestamp) for the matching records"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_records(self, filter_query: dict) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_record_selfie(self, record_id: str, include_data: bool) -> Optional[dict]:
+        """Return selfie metadata (and selfie_data if requested) for a record"""
+        raise NotImplementedError
+
+    def ensure_indexes(self) -> None:
+        """Create backend indexes (called once at startup)"""
+
+    def ping(self, timeout: float) -> None:
+        """Raise if the backend is unreachable, or TimeoutError if it takes longer than timeout seconds.
+
+        Implementations bound the round trip themselves so the calling thread
+        never outlives the probe.
+        """
+
+    def pool_stats(self) -> dict:
+        """Connection pool statistics, for backends that have a pool"""
+        return {}
+
+
+def matches_filter(doc: dict, filter_query: dict) -> bool:
+    """Evaluate an equality/range filter against a plain document"""
+    for field, expected in filter_query.items():
+        value = doc.get(field)
+        if isinstance(expected, dict):
+            if value is None:
+                return False
+            if "$gte" in expected and value < expected["$gte"]:
+                return False
+            if "$lte" in expected and value > expected["$lte"]:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+def sort_documents(docs: List[dict], sort: Optional[List[Tuple[str, int]]]) -> List[dict]:
+    # Stable sorts applied last key first give a multi-key sort
+    for field, direction in reversed(sort or []):
+        docs.sort(key=lambda doc: (doc.get(field) is not None, doc.get(field)), reverse=direction < 0)
+    return docs
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so readiness checks can report pool health"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open_connections = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def adjust(self, **deltas):
+        with self.lock:
+            for field, delta in deltas.items():
+                setattr(self, field, getattr(self, field) + delta)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "idle": self.open_connections - self.checked_out,
+                "waiting": self.waiting,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears
+            }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.adjust(pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.adjust(open_connections=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.adjust(open_connections=-1)
+
+    def connection_check_out_started(self, event):
+        self.adjust(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self.adjust(waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self.adjust(waiting=-1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self.adjust(checked_out=-1)
+
+
+class MongoStore(AttendanceStore):
+    """MongoDB-backed store (the production default)"""
+
+    name = "mongo"
+
+    def __init__(self, mongo_url: str, db_name: str, **client_options):
+        self.pool_listener = PoolStatsListener()
+        self.client_options = client_options
+        self.client = MongoClient(mongo_url, event_listeners=[self.pool_listener], **client_options)
+        self.db = self.client[db_name]
+        self.sessions = self.db.attendance_sessions
+        self.records = self.db.attendance_records
+
+    def create_session(self, session_doc: dict) -> None:
+        self.sessions.insert_one(dict(session_doc))
+
+    def get_active_session(self, session_id: str) -> Optional[dict]:
+        return self.sessions.find_one({"session_id": session_id, "is_active": True}, {"_id": 0})
+
+    def deactivate_sessions(self, filter_query: dict) -> int:
+        result = self.sessions.update_many(filter_query, {"$set": {"is_active": False}})
+        return result.modified_count
+
+    def expire_sessions(self, now: datetime) -> int:
+        result = self.sessions.update_many(
+            {"is_active": True, "expires_at": {"$lte": now}},
+            {"$set": {"is_active": False}}
+        )
+        return result.modified_count
+
+    def backfill_session_expiry(self, compute_expiry: Callable[[dict], datetime]) -> int:
+        legacy_sessions = self.sessions.find(
+            {"is_active": True, "expires_at": {"$exists": False}},
+            {"_id": 1, "date": 1, "time_slot": 1, "created_at": 1}
+        )
+        updates = [
+            UpdateOne({"_id": session["_id"]}, {"$set": {"expires_at": compute_expiry(session)}})
+            for session in legacy_sessions
+        ]
+        if not updates:
+            return 0
+        return self.sessions.bulk_write(updates, ordered=False).modified_count
+
+    def insert_record(self, record_doc: dict) -> None:
+        self.records.insert_one(dict(record_doc))
+
+    def record_exists(self, session_id: str, email: str) -> bool:
+        return self.records.find_one({"session_id": session_id, "email": email}, {"_id": 1}) is not None
+
+    def find_records(self, filter_query: dict, include_selfie: bool = False, sort: Optional[List[Tuple[str, int]]] = None) -> List[dict]:
+        # Drop _id so every backend returns the same fields
+        projection = {"_id": 0} if include_selfie else {"_id": 0, "selfie_data": 0}
+        cursor = self.records.find(filter_query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        return list(cursor)
+
+    def count_records(self, filter_query: dict) -> int:
+        return self.records.count_documents(filter_query)
+
+    def summarize_records(self, filter_query: dict) -> Tuple[int, Optional[datetime]]:
+        summary = list(self.records.aggregate([
+            {"$match": filter_query},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "last_timestamp": {"$max": "$timestamp"}}}
+        ]))
+        if not summary:
+            return 0, None
+        return summary[0]["count"], summary[0]["last_timestamp"]
+
+    def delete_records(self, filter_query: dict) -> int:
+        return self.records.delete_many(filter_query).deleted_count
+
+    def get_record_selfie(self, record_id: str, include_data: bool) -> Optional[dict]:
+        projection = {"_id": 0, "selfie_sha256": 1, "selfie_content_type": 1}
+        if include_data:
+            projection["selfie_data"] = 1
+        return self.records.find_one({"record_id": record_id}, projection)
+
+    def ensure_indexes(self) -> None:
+        # Partial index: only active sessions are indexed, so lookups and
+        # sweeps stay proportional to the open sessions, not the history
+        self.sessions.create_index(
+            [("session_id", 1), ("expires_at", 1)],
+            name="active_sessions",
+            partialFilterExpression={"is_active": True}
+        )
+        self.sessions.create_index(
+            [("expires_at", 1)],
+            name="active_sessions_expiry",
+            partialFilterExpression={"is_active": True}
+        )
+
+    def ping(self, timeout: float) -> None:
+        # Client-side operation timeout: covers server selection, pool checkout
+        # and the command itself (sent with a matching maxTimeMS)
+        try:
+            with operation_timeout(timeout):
+                self.client.admin.command("ping")
+        except PyMongoError as e:
+            if e.timeout:
+                raise TimeoutError(str(e)) from e
+            raise
+
+    def pool_stats(self) -> dict:
+        stats = self.pool_listener.snapshot()
+        stats["options"] = self.client_options
+        return stats
+
+
+class MemoryStore(AttendanceStore):
+    """Process-local store for tests and single-worker demos"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}  # session_id -> doc
+        self.records = {}  # record_id -> doc
+
+    def create_session(self, session_doc: dict) -> None:
+        with self.lock:
+            self.sessions[session_doc["session_id"]] = dict(session_doc)
+
+    def get_active_session(self, session_id: str) -> Optional[dict]:
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session or not session.get("is_active"):
+                return None
+            return dict(session)
+
+    def deactivate_sessions(self, filter_query: dict) -> int:
+        with self.lock:
+            count = 0
+            for session in self.sessions.values():
+                if session.get("is_active") and matches_filter(session, filter_query):
+                    session["is_active"] = False
+                    count += 1
+            return count
+
+    def expire_sessions(self, now: datetime) -> int:
+        with self.lock:
+            count = 0
+            for session in self.sessions.values():
+                if session.get("is_active") and session.get("expires_at") and session["expires_at"] <= now:
+                    session["is_active"] = False
+                    count += 1
+            return count
+
+    def backfill_session_expiry(self, compute_expiry: Callable[[dict], datetime]) -> int:
+        with self.lock:
+            count = 0
+            for session in self.sessions.values():
+                if session.get("is_active") and not session.get("expires_at"):
+                    session["expires_at"] = compute_expiry(session)
+                    count += 1
+            return count
+
+    def insert_record(self, record_doc: dict) -> None:
+        with self.lock:
+            self.records[record_doc["record_id"]] = dict(record_doc)
+
+    def record_exists(self, session_id: str, email: str) -> bool:
+        with self.lock:
+            return any(
+                record["session_id"] == session_id and record["email"] == email
+                for record in self.records.values()
+            )
+
+    def find_records(self, filter_query: dict, include_selfie: bool = False, sort: Optional[List[Tuple[str, int]]] = None) -> List[dict]:
+        with self.lock:
+            records = [
+                {key: value for key, value in record.items() if include_selfie or key != "selfie_data"}
+                for record in self.records.values()
+                if matches_filter(record, filter_query)
+            ]
+        return sort_documents(records, sort)
+
+    def count_records(self, filter_query: dict) -> int:
+        with self.lock:
+            return sum(1 for record in self.records.values() if matches_filter(record, filter_query))
+
+    def summarize_records(self, filter_query: dict) -> Tuple[int, Optional[datetime]]:
+        with self.lock:
+            timestamps = [
+                record.get("timestamp") for record in self.records.values()
+                if matches_filter(record, filter_query)
+            ]
+        present = [timestamp for timestamp in timestamps if timestamp]
+        return len(timestamps), max(present) if present else None
+
+    def delete_records(self, filter_query: dict) -> int:
+        with self.lock:
+            matching = [record_id for record_id, record in self.records.items() if matches_filter(record, filter_query)]
+            for record_id in matching:
+                del self.records[record_id]
+            return len(matching)
+
+    def get_record_selfie(self, record_id: str, include_data: bool) -> Optional[dict]:
+        with self.lock:
+            record = self.records.get(record_id)
+            if not record:
+                return None
+            fields = ["selfie_sha256", "selfie_content_type"] + (["selfie_data"] if include_data else [])
+            return {field: record[field] for field in fields if field in record}
+
+
+def encode_document(doc: dict) -> str:
+    return json.dumps({
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in doc.items()
+    })
+
+
+def decode_document(data: str) -> dict:
+    doc = json.loads(data)
+    for field in DATETIME_FIELDS:
+        if doc.get(field):
+            doc[field] = datetime.fromisoformat(doc[field])
+    return doc
+
+
+class SQLiteStore(AttendanceStore):
+    """SQLite store in WAL mode for small single-host deployments.
+
+    Filterable fields are real indexed columns; the rest of each document
+    is kept as JSON. Selfies live in their own column so listing records
+    never reads them.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        filter_columns = ", ".join(f"{field} TEXT" for field in FILTER_FIELDS)
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS attendance_sessions (
+                session_id TEXT PRIMARY KEY,
+                is_active INTEGER NOT NULL,
+                expires_at TEXT,
+                {filter_columns},
+                doc TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS attendance_records (
+                record_id TEXT PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                email TEXT NOT NULL,
+                timestamp TEXT,
+                {filter_columns},
+                selfie_data TEXT,
+                doc TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_records_session_email ON attendance_records (session_id, email);
+            CREATE INDEX IF NOT EXISTS idx_records_query ON attendance_records (semester, date, class_name, time_slot);
+            CREATE INDEX IF NOT EXISTS idx_sessions_query ON attendance_sessions (semester, date, class_name, time_slot);
+            CREATE INDEX IF NOT EXISTS idx_sessions_active ON attendance_sessions (expires_at) WHERE is_active = 1;
+        """)
+
+    def build_where(self, filter_query: dict, allowed: tuple) -> Tuple[str, list]:
+        clauses, params = [], []
+        for field, expected in filter_query.items():
+            if field not in allowed:
+                raise ValueError(f"Unsupported filter field: {field}")
+            if isinstance(expected, dict):
+                if "$gte" in expected:
+                    clauses.append(f"{field} >= ?")
+                    params.append(expected["$gte"])
+                if "$lte" in expected:
+                    clauses.append(f"{field} <= ?")
+                    params.append(expected["$lte"])
+            else:
+                clauses.append(f"{field} = ?")
+                params.append(expected)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def record_where(self, filter_query: dict) -> Tuple[str, list]:
+        return self.build_where(filter_query, FILTER_FIELDS + ("session_id", "email", "record_id"))
+
+    def create_session(self, session_doc: dict) -> None:
+        with self.lock:
+            self.conn.execute(
+                f"INSERT INTO attendance_sessions (session_id, is_active, expires_at, {', '.join(FILTER_FIELDS)}, doc) "
+                f"VALUES (?, ?, ?, {', '.join('?' for _ in FILTER_FIELDS)}, ?)",
+                [session_doc["session_id"], int(session_doc.get("is_active", True)), session_doc["expires_at"].isoformat()]
+                + [session_doc.get(field) for field in FILTER_FIELDS]
+                + [encode_document(session_doc)]
+            )
+
+    def get_active_session(self, session_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT expires_at, doc FROM attendance_sessions WHERE session_id = ? AND is_active = 1",
+                (session_id,)
+            ).fetchone()
+        if not row:
+            return None
+        # The columns are authoritative; the JSON copy is not updated by the sweeps
+        session = decode_document(row[1])
+        session["is_active"] = True
+        session["expires_at"] = datetime.fromisoformat(row[0]) if row[0] else None
+        return session
+
+    def deactivate_sessions(self, filter_query: dict) -> int:
+        where, params = self.build_where(filter_query, FILTER_FIELDS + ("session_id",))
+        where = f"{where} AND is_active = 1" if where else " WHERE is_active = 1"
+        with self.lock:
+            return self.conn.execute(f"UPDATE attendance_sessions SET is_active = 0{where}", params).rowcount
+
+    def expire_sessions(self, now: datetime) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE attendance_sessions SET is_active = 0 WHERE is_active = 1 AND expires_at <= ?",
+                (now.isoformat(),)
+            ).rowcount
+
+    def backfill_session_expiry(self, compute_expiry: Callable[[dict], datetime]) -> int:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT session_id, doc FROM attendance_sessions WHERE is_active = 1 AND expires_at IS NULL"
+            ).fetchall()
+            for session_id, data in rows:
+                session = decode_document(data)
+                session["expires_at"] = compute_expiry(session)
+                self.conn.execute(
+                    "UPDATE attendance_sessions SET expires_at = ?, doc = ? WHERE session_id = ?",
+                    (session["expires_at"].isoformat(), encode_document(session), session_id)
+                )
+            return len(rows)
+
+    def insert_record(self, record_doc: dict) -> None:
+        doc = {key: value for key, value in record_doc.items() if key != "selfie_data"}
+        timestamp = record_doc.get("timestamp")
+        with self.lock:
+            self.conn.execute(
+                f"INSERT INTO attendance_records (record_id, session_id, email, timestamp, {', '.join(FILTER_FIELDS)}, selfie_data, doc) "
+                f"VALUES (?, ?, ?, ?, {', '.join('?' for _ in FILTER_FIELDS)}, ?, ?)",
+                [record_doc["record_id"], record_doc["session_id"], record_doc["email"],
+                 timestamp.isoformat() if timestamp else None]
+                + [record_doc.get(field) for field in FILTER_FIELDS]
+                + [record_doc.get("selfie_data"), encode_document(doc)]
+            )
+
+    def record_exists(self, session_id: str, email: str) -> bool:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM attendance_records WHERE session_id = ? AND email = ? LIMIT 1",
+                (session_id, email)
+            ).fetchone() is not None
+
+    def find_records(self, filter_query: dict, include_selfie: bool = False, sort: Optional[List[Tuple[str, int]]] = None) -> List[dict]:
+        where, params = self.record_where(filter_query)
+        order = ""
+        if sort:
+            order = " ORDER BY " + ", ".join(
+                f"{field} {'DESC' if direction < 0 else 'ASC'}"
+                for field, direction in sort
+                if field in FILTER_FIELDS + ("timestamp",)
+            )
+        columns = "doc, selfie_data" if include_selfie else "doc"
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {columns} FROM attendance_records{where}{order}", params).fetchall()
+        records = []
+        for row in rows:
+            record = decode_document(row[0])
+            if include_selfie:
+                record["selfie_data"] = row[1]
+            records.append(record)
+        return records
+
+    def count_records(self, filter_query: dict) -> int:
+        where, params = self.record_where(filter_query)
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM attendance_records{where}", params).fetchone()[0]
+
+    def summarize_records(self, filter_query: dict) -> Tuple[int, Optional[datetime]]:
+        where, params = self.record_where(filter_query)
+        with self.lock:
+            count, last_timestamp = self.conn.execute(
+                f"SELECT COUNT(*), MAX(timestamp) FROM attendance_records{where}", params
+            ).fetchone()
+        return count, datetime.fromisoformat(last_timestamp) if last_timestamp else None
+
+    def delete_records(self, filter_query: dict) -> int:
+        where, params = self.record_where(filter_query)
+        with self.lock:
+            return self.conn.execute(f"DELETE FROM attendance_records{where}", params).rowcount
+
+    def get_record_selfie(self, record_id: str, include_data: bool) -> Optional[dict]:
+        columns = "doc, selfie_data" if include_data else "doc"
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {columns} FROM attendance_records WHERE record_id = ?", (record_id,)
+            ).fetchone()
+        if not row:
+            return None
+        doc = decode_document(row[0])
+        selfie = {field: doc[field] for field in ("selfie_sha256", "selfie_content_type") if field in doc}
+        if include_data:
+            selfie["selfie_data"] = row[1]
+        return selfie
+
+    def ping(self, timeout: float) -> None:
+        # The lock is held for every statement, so a long write would stall the probe
+        if not self.lock.acquire(timeout=timeout):
+            raise TimeoutError(f"SQLite connection busy for more than {timeout}s")
+        try:
+            self.conn.execute("SELECT 1").fetchone()
+        finally:
+            self.lock.release()
+
+
+def create_store(backend: str, mongo_url: str = None, db_name: str = None, sqlite_path: str = None, mongo_options: dict = None) -> AttendanceStore:
+    """Build the store selected by the STORAGE_BACKEND setting"""
+    if backend == "mongo":
+        return MongoStore(mongo_url, db_name, **(mongo_options or {}))
+    if backend == "sqlite":
+        return SQLiteStore(sqlite_path)
+    if backend == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -4,6 +4,7 @@ import json
 from datetime import datetime, date
 import tempfile
 import os
+import time
 
 class AttendanceSystemTester:
     def __init__(self, base_url="https://edutrack-63.preview.emergentagent.com"):
@@ -28,10 +29,10 @@ class AttendanceSystemTester:
             }
         }
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, files=None, response_type='json'):
+    def run_test(self, name, method, endpoint, expected_status, data=None, files=None, response_type='json', extra_headers=None):
         """Run a single API test"""
         url = f"{self.base_url}/{endpoint}"
-        headers = {}
+        headers = dict(extra_headers or {})
         
         if files is None:
             headers['Content-Type'] = 'application/json'
@@ -87,6 +88,21 @@ class AttendanceSystemTester:
         )
         return success
 
+    def test_readiness_check(self):
+        """Test readiness endpoint (database round trip)"""
+        success, response = self.run_test(
+            "Readiness Check",
+            "GET",
+            "api/health/ready",
+            200
+        )
+        
+        if success:
+            print(f"   DB latency: {response.get('db_latency_ms')} ms")
+            print(f"   Pool: {response.get('pool')}")
+        
+        return success
+
     def test_create_session(self):
         """Test creating attendance session"""
         success, response = self.run_test(
@@ -214,6 +230,44 @@ class AttendanceSystemTester:
         
         return success
 
+    def test_submit_attendance_idempotent_replay(self):
+        """Test that a retried submission with the same Idempotency-Key is replayed"""
+        if not self.session_id:
+            print("❌ No session ID available for testing")
+            return False
+        
+        mock_image_content = b'\x89PNG\r\n\x1a\n'
+        form_data = {
+            'session_id': self.session_id,
+            'student_name': "Jane Roe",
+            'enrollment_number': "CS002",
+            'email': "jane.roe@charusat.edu.in"
+        }
+        idempotency_key = f"backend-test-{self.session_id}"
+        
+        responses = []
+        for attempt in range(2):
+            success, response = self.run_test(
+                f"Submit Attendance (Idempotency-Key attempt {attempt + 1})",
+                "POST",
+                "api/student/submit-attendance",
+                200,
+                data=form_data,
+                files={'selfie': ('selfie.png', mock_image_content, 'image/png')},
+                extra_headers={"Idempotency-Key": idempotency_key}
+            )
+            if not success:
+                return False
+            responses.append(response)
+        
+        if responses[0] == responses[1]:
+            print("   ✅ Retry replayed the original response")
+        else:
+            print("   ❌ Retry returned a different response")
+            return False
+        
+        return True
+
     def test_get_attendance(self):
         """Test getting attendance records"""
         query_data = {
@@ -253,6 +307,51 @@ class AttendanceSystemTester:
         
         return success
 
+    def test_get_selfie(self):
+        """Test selfie retrieval with ETag revalidation"""
+        query_data = {
+            "class_name": self.test_data["session"]["class_name"],
+            "time_slot": self.test_data["session"]["time_slot"],
+            "faculty": self.test_data["session"]["faculty"],
+            "subject": self.test_data["session"]["subject"],
+            "semester": self.test_data["session"]["semester"],
+            "date": self.test_data["session"]["date"]
+        }
+        
+        response = requests.post(f"{self.base_url}/api/teacher/get-attendance", json=query_data)
+        records = response.json().get('records', []) if response.status_code == 200 else []
+        selfie_urls = [record['selfie_url'] for record in records if 'selfie_url' in record]
+        
+        if not selfie_urls:
+            print("❌ No selfie URL available for testing")
+            return False
+        
+        selfie_url = selfie_urls[0].lstrip('/')
+        first = requests.get(f"{self.base_url}/{selfie_url}")
+        etag = first.headers.get('ETag')
+        
+        success, _ = self.run_test(
+            "Get Selfie",
+            "GET",
+            selfie_url,
+            200,
+            response_type='binary'
+        )
+        
+        if not success or not etag:
+            return False
+        
+        success, _ = self.run_test(
+            "Get Selfie (Not Modified)",
+            "GET",
+            selfie_url,
+            304,
+            response_type='binary',
+            extra_headers={"If-None-Match": etag}
+        )
+        
+        return success
+
     def test_download_attendance(self):
         """Test downloading attendance as Excel"""
         query_data = {
@@ -293,6 +392,62 @@ class AttendanceSystemTester:
         
         return success
 
+    def test_export_job(self):
+        """Test background date-range export job"""
+        export_data = {
+            "semester": self.test_data["session"]["semester"],
+            "class_name": self.test_data["session"]["class_name"],
+            "start_date": self.test_data["session"]["date"],
+            "end_date": self.test_data["session"]["date"],
+            "format": "xlsx"
+        }
+        
+        success, response = self.run_test(
+            "Create Export Job",
+            "POST",
+            "api/teacher/export-jobs",
+            200,
+            data=export_data
+        )
+        
+        if not success or 'job_id' not in response:
+            return False
+        
+        job_id = response['job_id']
+        print(f"   Job ID: {job_id}")
+        
+        # Poll until the job finishes
+        status = response.get('status')
+        for _ in range(30):
+            if status in ('completed', 'failed'):
+                break
+            time.sleep(1)
+            success, response = self.run_test(
+                "Poll Export Job",
+                "GET",
+                f"api/teacher/export-jobs/{job_id}",
+                200
+            )
+            status = response.get('status')
+            print(f"   Status: {status} ({response.get('progress')}%)")
+        
+        if status != 'completed':
+            print(f"   ❌ Export job did not complete: {response.get('error')}")
+            return False
+        
+        success, response_content = self.run_test(
+            "Download Export Job",
+            "GET",
+            f"api/teacher/export-jobs/{job_id}/download",
+            200,
+            response_type='binary'
+        )
+        
+        if success and len(response_content) > 0:
+            print("   ✅ Export workbook downloaded successfully")
+        
+        return success
+
     def test_reset_attendance(self):
         """Test resetting attendance records"""
         query_data = {
@@ -327,13 +482,17 @@ class AttendanceSystemTester:
         # Test sequence
         tests = [
             self.test_health_check,
+            self.test_readiness_check,
             self.test_create_session,
             self.test_get_session_info,
             self.test_student_authentication,
             self.test_student_authentication_invalid_email,
             self.test_submit_attendance,
+            self.test_submit_attendance_idempotent_replay,
             self.test_get_attendance,
+            self.test_get_selfie,
             self.test_download_attendance,
+            self.test_export_job,
             self.test_reset_attendance
         ]
         
@@ -451,6 +451,8 @@ function StudentAttendance() {
   const [cameraStream, setCameraStream] = useState(null);
   const videoRef = useRef(null);
   const canvasRef = useRef(null);
+  // One key per captured selfie so retried uploads are replayed, not re-processed
+  const idempotencyKeyRef = useRef(null);
 
   const sessionId = searchParams.get('session_id');
 
@@ -524,6 +526,9 @@ function StudentAttendance() {
       context.drawImage(video, 0, 0);
       
       canvas.toBlob((blob) => {
+        idempotencyKeyRef.current = window.crypto?.randomUUID
+          ? window.crypto.randomUUID()
+          : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
         setSelfie(blob);
         stopCamera();
       }, 'image/jpeg', 0.8);
@@ -548,6 +553,7 @@ function StudentAttendance() {
       const response = await axios.post(`${API_BASE_URL}/api/student/submit-attendance`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
+          'Idempotency-Key': idempotencyKeyRef.current,
         },
       });
 
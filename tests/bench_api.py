@@ -0,0 +1,116 @@
+"""Route-level benchmark run against each in-process storage backend.
+
+    python tests/bench_api.py [--students N] [--backends memory,sqlite]
+
+Times the hot student/teacher paths through the real FastAPI app with
+TestClient, so numbers include routing, validation and serialization.
+Set TEST_MONGO_URL to include MongoDB.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+from storage import MemoryStore, MongoStore, SQLiteStore  # noqa: E402
+
+SESSION = {
+    "time_slot": "9:00-10:00",
+    "lecture_or_lab": "Lecture",
+    "subject": "Benchmark",
+    "faculty": "Dr. Bench",
+    "class_name": "CSE-B",
+    "semester": "3",
+    "date": date.today().isoformat()
+}
+QUERY = {key: value for key, value in SESSION.items() if key != "lecture_or_lab"}
+SELFIE = b"\x89PNG\r\n\x1a\n" + b"\x00" * 4096
+
+
+def make_store(backend: str, workdir: str):
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "sqlite":
+        return SQLiteStore(os.path.join(workdir, "bench.db"))
+    return MongoStore(os.environ["TEST_MONGO_URL"], f"attendance_bench_{uuid.uuid4().hex}")
+
+
+def timed(samples: list, call):
+    started = time.perf_counter()
+    response = call()
+    samples.append((time.perf_counter() - started) * 1000)
+    assert response.status_code < 400, response.text
+    return response
+
+
+def run_backend(backend: str, students: int) -> dict:
+    """Return per-route latency samples (ms) for one backend"""
+    with tempfile.TemporaryDirectory() as workdir:
+        store = make_store(backend, workdir)
+        server.store = store
+        server.idempotency_store.clear()
+        server.closed_session_ids.clear()
+        client = TestClient(server.app)
+        samples = {"session_info": [], "submit": [], "get_attendance": [], "selfie": []}
+
+        session_id = client.post("/api/teacher/create-session", json=SESSION).json()["session_id"]
+        for index in range(students):
+            timed(samples["session_info"], lambda: client.get(f"/api/session/{session_id}"))
+            timed(samples["submit"], lambda: client.post(
+                "/api/student/submit-attendance",
+                data={
+                    "session_id": session_id,
+                    "student_name": f"Student {index}",
+                    "enrollment_number": f"BENCH{index:04d}",
+                    "email": f"student{index}@charusat.edu.in"
+                },
+                files={"selfie": ("selfie.png", SELFIE, "image/png")}
+            ))
+
+        records = []
+        for _ in range(10):
+            records = timed(samples["get_attendance"], lambda: client.post("/api/teacher/get-attendance", json=QUERY)).json()["records"]
+        for record in records:
+            timed(samples["selfie"], lambda: client.get(record["selfie_url"]))
+
+        if backend == "mongo":
+            store.client.drop_database(store.db.name)
+        return samples
+
+
+def summarize(samples: list) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"n={len(samples):<5} median={statistics.median(ordered):7.2f}ms p95={p95:7.2f}ms"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=200)
+    default_backends = "memory,sqlite" + (",mongo" if os.environ.get("TEST_MONGO_URL") else "")
+    parser.add_argument("--backends", default=default_backends)
+    args = parser.parse_args(argv)
+
+    original_store = server.store
+    try:
+        for backend in args.backends.split(","):
+            print(f"== {backend}")
+            for route, samples in run_backend(backend, args.students).items():
+                print(f"   {route:<15} {summarize(samples)}")
+    finally:
+        server.store = original_store
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
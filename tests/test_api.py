@@ -0,0 +1,407 @@
+"""Route-level tests run against every in-process storage backend.
+
+Set TEST_MONGO_URL to also run them against a live MongoDB.
+"""
+import os
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+from storage import MemoryStore, MongoStore, SQLiteStore  # noqa: E402
+
+BACKENDS = ["memory", "sqlite"] + (["mongo"] if os.environ.get("TEST_MONGO_URL") else [])
+
+SESSION = {
+    "time_slot": "9:00-10:00",
+    "lecture_or_lab": "Lecture",
+    "subject": "Computer Science",
+    "faculty": "Dr. Smith",
+    "class_name": "CSE-A",
+    "semester": "3",
+    "date": date.today().isoformat()
+}
+QUERY = {key: value for key, value in SESSION.items() if key != "lecture_or_lab"}
+SELFIE = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+@pytest.fixture(params=BACKENDS)
+def client(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        store = MemoryStore()
+    elif request.param == "sqlite":
+        store = SQLiteStore(str(tmp_path / "attendance.db"))
+    else:
+        store = MongoStore(os.environ["TEST_MONGO_URL"], f"attendance_test_{uuid.uuid4().hex}")
+    monkeypatch.setattr(server, "store", store)
+    server.idempotency_store.clear()
+    server.export_cache.clear()
+    server.closed_session_ids.clear()
+    yield TestClient(server.app)
+    if request.param == "mongo":
+        store.client.drop_database(store.db.name)
+
+
+def create_session(client):
+    response = client.post("/api/teacher/create-session", json=SESSION)
+    assert response.status_code == 200
+    return response.json()["session_id"]
+
+
+def submit(client, session_id, email="john.doe@charusat.edu.in", headers=None):
+    return client.post(
+        "/api/student/submit-attendance",
+        data={
+            "session_id": session_id,
+            "student_name": "John Doe",
+            "enrollment_number": "CS001",
+            "email": email
+        },
+        files={"selfie": ("selfie.png", SELFIE, "image/png")},
+        headers=headers or {}
+    )
+
+
+def test_session_lifecycle(client):
+    session_id = create_session(client)
+
+    response = client.get(f"/api/session/{session_id}")
+    assert response.status_code == 200
+    assert response.json()["session_info"]["subject"] == SESSION["subject"]
+
+    auth = {"session_id": session_id, "email": "x@gmail.com", "name": "X", "enrollment_number": "1"}
+    assert client.post("/api/student/authenticate", json=auth).status_code == 403
+
+    assert submit(client, session_id).status_code == 200
+    assert submit(client, session_id).status_code == 409
+
+    response = client.post("/api/teacher/reset-attendance", json=QUERY)
+    assert response.json()["deleted_count"] == 1
+    assert client.get(f"/api/session/{session_id}").status_code == 404
+
+
+def test_get_attendance_excludes_selfie(client):
+    session_id = create_session(client)
+    submit(client, session_id)
+
+    response = client.post("/api/teacher/get-attendance", json=QUERY)
+    assert response.status_code == 200
+    records = response.json()["records"]
+    assert len(records) == 1
+    assert "selfie_data" not in records[0]
+    assert "_id" not in records[0]
+    assert records[0]["selfie_url"].endswith("/selfie")
+
+
+def test_selfie_etag_and_range(client):
+    session_id = create_session(client)
+    submit(client, session_id)
+    selfie_url = client.post("/api/teacher/get-attendance", json=QUERY).json()["records"][0]["selfie_url"]
+
+    response = client.get(selfie_url)
+    assert response.status_code == 200
+    assert response.content == SELFIE
+    etag = response.headers["etag"]
+
+    assert client.get(selfie_url, headers={"If-None-Match": etag}).status_code == 304
+
+    response = client.get(selfie_url, headers={"Range": "bytes=0-7"})
+    assert response.status_code == 206
+    assert response.content == SELFIE[:8]
+
+    assert client.get(selfie_url, headers={"Range": "bytes=1000-"}).status_code == 416
+    # Unknown units and multi-range requests are ignored, not rejected
+    for range_header in ("items=0-1", "bytes=0-1,4-5"):
+        response = client.get(selfie_url, headers={"Range": range_header})
+        assert response.status_code == 200
+        assert response.content == SELFIE
+
+
+def test_selfie_is_never_served_as_uploaded_type(client):
+    session_id = create_session(client)
+    client.post(
+        "/api/student/submit-attendance",
+        data={
+            "session_id": session_id,
+            "student_name": "John Doe",
+            "enrollment_number": "CS001",
+            "email": "john.doe@charusat.edu.in"
+        },
+        files={"selfie": ("selfie.html", b"<script>alert(1)</script>", "text/html")}
+    )
+    selfie_url = client.post("/api/teacher/get-attendance", json=QUERY).json()["records"][0]["selfie_url"]
+
+    response = client.get(selfie_url)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["x-content-type-options"] == "nosniff"
+    assert response.headers["content-disposition"] == 'inline; filename="selfie.bin"'
+
+
+def test_idempotent_submission_is_replayed(client):
+    session_id = create_session(client)
+    headers = {"Idempotency-Key": "retry-1"}
+
+    first = submit(client, session_id, headers=headers)
+    second = submit(client, session_id, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert second.headers["idempotent-replayed"] == "true"
+    assert client.post("/api/teacher/get-attendance", json=QUERY).json()["total_attendance"] == 1
+
+
+def test_idempotent_retry_from_new_network_is_replayed(client):
+    session_id = create_session(client)
+    headers = {"Idempotency-Key": "retry-2"}
+
+    first = submit(client, session_id, headers=headers)
+    # The phone dropped Wi-Fi and retried over mobile data
+    mobile_client = TestClient(server.app, client=("10.20.30.40", 50001))
+    second = submit(mobile_client, session_id, headers=headers)
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers["idempotent-replayed"] == "true"
+
+
+def test_middleware_passes_other_routes_through():
+    # Non-submission routes go straight to the app, untouched by the idempotency layer
+    assert server.IdempotencyMiddleware in [middleware.cls for middleware in server.app.user_middleware]
+    server.idempotency_store.clear()
+    client = TestClient(server.app)
+    response = client.get("/api/health", headers={"Idempotency-Key": "ignored"})
+    assert response.status_code == 200
+    assert "idempotent-replayed" not in response.headers
+    assert not server.idempotency_store
+
+
+def test_reused_idempotency_key_for_other_request_is_rejected(client):
+    session_id = create_session(client)
+    headers = {"Idempotency-Key": "retry-1"}
+
+    assert submit(client, session_id, headers=headers).status_code == 200
+    response = submit(client, session_id, email="someone.else@charusat.edu.in", headers=headers)
+    assert response.status_code == 422
+
+
+def test_idempotency_eviction_keeps_in_flight_keys(monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_MAX_KEYS", 1)
+    server.idempotency_store.clear()
+    expires_at = time.monotonic() + 60
+    server.idempotency_store["a"] = {"status": "in_flight", "expires_at": expires_at}
+    server.idempotency_store["b"] = {"status": "completed", "expires_at": expires_at}
+    server.idempotency_store["c"] = {"status": "completed", "expires_at": expires_at}
+
+    server.evict_idempotency_keys()
+    assert list(server.idempotency_store) == ["a"]
+    server.idempotency_store.clear()
+
+
+def test_download_and_export_job(client):
+    session_id = create_session(client)
+    submit(client, session_id)
+
+    response = client.post("/api/teacher/download-attendance", json=QUERY)
+    assert response.status_code == 200
+    assert len(response.content) > 0
+
+    export = {"semester": SESSION["semester"], "start_date": SESSION["date"], "end_date": SESSION["date"]}
+    job = client.post("/api/teacher/export-jobs", json=export).json()
+    for _ in range(100):
+        job = client.get(f"/api/teacher/export-jobs/{job['job_id']}").json()
+        if job["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "completed", job.get("error")
+    assert client.get(job["download_url"]).status_code == 200
+
+
+def test_session_expiry_and_sweep(client):
+    session_id = create_session(client)
+    assert client.get(f"/api/session/{session_id}").json()["session_info"]["expires_at"]
+
+    assert server.store.expire_sessions(datetime.now() + timedelta(days=1)) == 1
+    assert client.get(f"/api/session/{session_id}").status_code == 404
+    assert submit(client, session_id).status_code == 404
+
+
+def test_compute_session_expiry():
+    created_at = datetime(2026, 10, 19, 8, 30)
+    grace = timedelta(minutes=server.SESSION_GRACE_MINUTES)
+
+    assert server.compute_session_expiry("2026-10-19", "9:00-10:00", created_at) == datetime(2026, 10, 19, 10, 0) + grace
+    # Created after the slot ended: still open for the grace period
+    assert server.compute_session_expiry("2026-10-18", "9:00-10:00", created_at) == created_at + grace
+    assert server.compute_session_expiry("2026-10-19", "morning", created_at) == created_at + timedelta(minutes=server.SESSION_DEFAULT_MINUTES)
+
+
+def test_liveness_and_readiness(client):
+    assert client.get("/api/health/live").status_code == 200
+
+    response = client.get("/api/health/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+    assert "pool" in response.json()
+
+
+def test_readiness_fails_when_storage_is_slow(client, monkeypatch):
+    def slow_ping(timeout):
+        raise TimeoutError(f"ping exceeded {timeout}s")
+
+    monkeypatch.setattr(server, "READINESS_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(server.store, "ping", slow_ping)
+
+    response = client.get("/api/health/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "degraded"
+    # Liveness does not depend on the database
+    assert client.get("/api/health/live").status_code == 200
+
+
+def test_sqlite_ping_is_bounded(tmp_path):
+    store = SQLiteStore(str(tmp_path / "ping.db"))
+    store.ping(0.05)
+    with store.lock:
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            store.ping(0.05)
+        assert time.monotonic() - started < 0.5
+
+
+def test_export_job_fails_cleanly_when_records_vanish(client, monkeypatch):
+    session_id = create_session(client)
+    submit(client, session_id)
+
+    # Simulate a reset landing between job submission and the worker running
+    monkeypatch.setattr(server.export_executor, "submit", lambda *args: None)
+    export = {"semester": SESSION["semester"]}
+    job_id = client.post("/api/teacher/export-jobs", json=export).json()["job_id"]
+    client.post("/api/teacher/reset-attendance", json=QUERY)
+
+    query = server.ExportJobQuery(**export)
+    server.run_export_job(job_id, server.build_export_filter(query), "xlsx", "test-key")
+    job = client.get(f"/api/teacher/export-jobs/{job_id}").json()
+    assert job["status"] == "failed"
+    assert job["error"] == "No attendance records found"
+
+
+def create_legacy_session(legacy):
+    # Stores write expires_at on insert, so strip it to mimic a pre-expiry session
+    server.store.create_session({**legacy, "expires_at": datetime(2020, 1, 1)})
+    if isinstance(server.store, SQLiteStore):
+        server.store.conn.execute("UPDATE attendance_sessions SET expires_at = NULL")
+    elif isinstance(server.store, MemoryStore):
+        del server.store.sessions[legacy["session_id"]]["expires_at"]
+    else:
+        server.store.sessions.update_many({}, {"$unset": {"expires_at": ""}})
+
+
+def test_legacy_sessions_are_backfilled_and_swept(client):
+    legacy = {
+        **SESSION,
+        "session_id": str(uuid.uuid4()),
+        "date": "2020-01-01",
+        "created_at": datetime(2020, 1, 1, 8, 0),
+        "is_active": True
+    }
+    create_legacy_session(legacy)
+
+    assert server.store.backfill_session_expiry(server.compute_legacy_session_expiry) == 1
+    assert server.store.expire_sessions(datetime.now()) == 1
+    assert server.store.backfill_session_expiry(server.compute_legacy_session_expiry) == 0
+
+
+def test_legacy_session_stays_open_before_backfill(client):
+    legacy = {**SESSION, "session_id": str(uuid.uuid4()), "created_at": datetime.now(), "is_active": True}
+    legacy["time_slot"] = "TBA"  # no slot end, so the default lecture length applies
+    create_legacy_session(legacy)
+
+    response = client.get(f"/api/session/{legacy['session_id']}")
+    assert response.status_code == 200
+    assert response.json()["session_info"]["expires_at"]
+    assert legacy["session_id"] not in server.closed_session_ids
+
+    # Unknown IDs are rejected but not remembered
+    assert client.get(f"/api/session/{uuid.uuid4()}").status_code == 404
+    assert not server.closed_session_ids
+
+    # A legacy session whose computed expiry has passed is closed and remembered
+    expired = {**legacy, "session_id": str(uuid.uuid4()), "date": "2020-01-01", "created_at": datetime(2020, 1, 1, 8, 0)}
+    create_legacy_session(expired)
+    assert client.get(f"/api/session/{expired['session_id']}").status_code == 404
+    assert expired["session_id"] in server.closed_session_ids
+
+    # Startup finishes the backfill before serving
+    with TestClient(server.app):
+        assert server.store.backfill_session_expiry(server.compute_legacy_session_expiry) == 0
+
+
+def test_export_job_validates_dates(client):
+    export = {"semester": "3", "start_date": "2026-10-31", "end_date": "2026-10-01"}
+    assert client.post("/api/teacher/export-jobs", json=export).status_code == 400
+    assert client.post("/api/teacher/export-jobs", json={"semester": "3", "start_date": "2026-9-1"}).status_code == 422
+
+
+def test_export_sessions_are_in_chronological_order():
+    records = [{"date": "2026-10-01", "time_slot": slot} for slot in ("14:00-15:00", "10:00-11:00", "9:00-10:00")]
+    records.sort(key=lambda record: server.time_slot_start_minutes(record["time_slot"]))
+    assert [record["time_slot"] for record in records] == ["9:00-10:00", "10:00-11:00", "14:00-15:00"]
+
+
+def test_selfie_thumbnail(client, monkeypatch):
+    import io
+    from PIL import Image
+
+    session_id = create_session(client)
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 600), "red").save(buffer, format="JPEG")
+    client.post(
+        "/api/student/submit-attendance",
+        data={
+            "session_id": session_id,
+            "student_name": "John Doe",
+            "enrollment_number": "CS001",
+            "email": "john.doe@charusat.edu.in"
+        },
+        files={"selfie": ("selfie.jpg", buffer.getvalue(), "image/jpeg")}
+    )
+    thumbnail_url = client.post("/api/teacher/get-attendance", json=QUERY).json()["records"][0]["thumbnail_url"]
+
+    response = client.get(thumbnail_url)
+    assert response.status_code == 200
+    assert max(Image.open(io.BytesIO(response.content)).size) <= server.SELFIE_THUMBNAIL_SIZE
+
+    # Oversized images are refused rather than failing with a 500
+    server.selfie_thumbnail_cache.clear()
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    assert client.get(thumbnail_url).status_code == 415
+
+
+def test_store_missing_methods_fails_at_construction():
+    from storage import AttendanceStore
+
+    class IncompleteStore(AttendanceStore):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteStore()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_benchmark_runs(backend, monkeypatch):
+    import bench_api
+
+    # run_backend swaps server.store; monkeypatch puts the original back
+    monkeypatch.setattr(server, "store", server.store)
+    samples = bench_api.run_backend(backend, students=3)
+    assert len(samples["submit"]) == 3
+    assert len(samples["selfie"]) == 3